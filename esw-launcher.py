@@ -17,7 +17,7 @@ try:
 except subprocess.CalledProcessError:
     print("[!] Error upgrading pip")
 
-dependencies = ["moviepy", "flask", "pyte", "numpy", "Pillow"]
+dependencies = ["moviepy", "flask", "pyte", "numpy", "Pillow", "gunicorn"]
 
 for dep in dependencies:
     try:
@@ -7,15 +7,21 @@ import tempfile
 import gzip
 import json
 import re
-from flask import Flask, render_template_string, request, send_file, send_from_directory, jsonify
-from glob import glob
+import itertools
+import time
+import hashlib
+import signal
+import multiprocessing
+import argparse
+from flask import Flask, Response, render_template_string, request, send_file, send_from_directory, jsonify
+from glob import glob, escape as glob_escape
 from datetime import datetime
 from collections import defaultdict
 import numpy as np
 
 venv_path = os.path.expanduser("~/.venv/exegol-replay")
 expected_python = os.path.join(venv_path, "bin", "python3")
-required_pkgs = ["flask", "moviepy", "pyte", "numpy", "Pillow"]
+required_pkgs = ["flask", "moviepy", "pyte", "numpy", "Pillow", "gunicorn"]
 
 def ensure_venv():
     if sys.executable != expected_python and not os.environ.get("IN_VENV"):
@@ -35,34 +41,87 @@ ensure_venv()
 import moviepy.editor as mpy
 import pyte
 import tty2img
+import sessionarchive
+import sessionstate
 
 app = Flask(__name__, static_folder='.')
 
 ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+WORKSPACES = os.path.expanduser("~/.exegol/workspaces")
+# Set by --serve: MP4 renders go through the shared job queue to the render workers.
+render_queue = False
+# MP4 paths being rendered by threads of this process when not using --serve.
+rendering = set()
+rendering_lock = threading.Lock()
+
+def open_log(path):
+    if sessionarchive.is_archived(path):
+        return sessionarchive.open_session(path)
+    opener = gzip.open if path.endswith(".gz") else open
+    return opener(path, 'rt', encoding='utf-8', errors='ignore')
 
 @app.route("/logo.png")
 def logo():
     return send_from_directory('.', 'logo.png')
 
+def read_session_timestamp(path):
+    try:
+        with open_log(path) as f:
+            line = f.readline()
+            header = json.loads(line) if line.startswith('{') else {}
+            return header.get('timestamp', os.path.getmtime(path))
+    except Exception as e:
+        print(f"[!] Error reading {path}: {e}")
+        return os.path.getmtime(path)
+
+def render_failed(progress_path):
+    try:
+        with open(progress_path) as f:
+            return json.load(f).get("text", "").startswith("Error")
+    except Exception:
+        return False
+
+def start_render(func, *args):
+    # A progress file only records the last attempt: a render is live while its job is
+    # queued/running (--serve) or a thread of this process owns it, otherwise start again.
+    mp4_path, progress_path = args[1], args[2]
+    if os.path.exists(mp4_path):
+        return
+
+    def mark_queued():
+        with open(progress_path, "w") as pf:
+            pf.write(json.dumps({"progress": 0, "done": False, "text": "Queued..."}))
+
+    if render_queue:
+        sessionstate.enqueue_job(mp4_path, func.__name__, list(args), on_queued=mark_queued)
+        return
+    with rendering_lock:
+        if mp4_path in rendering:
+            return
+        rendering.add(mp4_path)
+    mark_queued()
+    threading.Thread(target=run_render, args=(func, args), daemon=True).start()
+
+def run_render(func, args):
+    try:
+        func(*args)
+    finally:
+        with rendering_lock:
+            rendering.discard(args[1])
+
 @app.route("/")
 def index():
-    base = os.path.expanduser("~/.exegol/workspaces")
     selected = request.args.get("container")
     start = request.args.get("start")
     end = request.args.get("end")
     files, containers = [], set()
-    for path in glob(base + "/*/logs/*.asciinema*"):
+    live = glob(WORKSPACES + "/*/logs/*.asciinema*")
+    # Sessions archived with --keep still have their .gz: list them once.
+    kept = {sessionarchive.archive_path(p) for p in live}
+    paths = live + [p for p in glob(sessionarchive.ARCHIVE_ROOT + "/*/logs/*.asciinema*") if p not in kept]
+    for path, ts in sessionstate.session_timestamps(paths, read_session_timestamp).items():
         container = path.split(os.sep)[-3]
         containers.add(container)
-        try:
-            open_func = gzip.open if path.endswith(".gz") else open
-            with open_func(path, 'rt', errors='ignore') as f:
-                line = f.readline()
-                header = json.loads(line) if line.startswith('{') else {}
-                ts = header.get('timestamp', os.path.getmtime(path))
-        except Exception as e:
-            print(f"[!] Error reading {path}: {e}")
-            ts = os.path.getmtime(path)
         files.append((container, datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), path))
     containers = sorted(containers)
     result = []
@@ -147,6 +206,7 @@ def view():
     cast_path = convert_to_cast(path)
     container = path.split("/")[-3]
     cast_name = os.path.basename(cast_path)
+    extract_path = path if sessionarchive.is_archived(path) else cast_path
     if download_only:
         return send_file(cast_path, as_attachment=True, download_name=cast_name)
     title = f"Replay {container} from " + os.path.basename(path).split("_shell")[0].replace("_", " ")
@@ -180,7 +240,7 @@ function parseTime(timeStr) {{
 function downloadExtract() {{
   const s = document.getElementById('start').value;
   const e = document.getElementById('end').value;
-  let url = `/extract?file={cast_path}`;
+  let url = `/extract?file={extract_path}`;
   const startSec = parseTime(s);
   const endSec = parseTime(e);
   if (startSec !== null && endSec !== null && endSec > startSec) {{
@@ -216,8 +276,7 @@ def processing():
     cast_path = convert_to_cast(file)
     mp4_path = cast_path.replace(".cast", ".mp4")
     progress_path = mp4_path + ".progress"
-    if not (os.path.exists(mp4_path) or os.path.exists(progress_path)):
-        threading.Thread(target=convert_cast_to_mp4_progress, args=(cast_path, mp4_path, progress_path), daemon=True).start()
+    start_render(convert_cast_to_mp4_progress, cast_path, mp4_path, progress_path)
     return render_template_string("""
 <html><head>
 <title>Generating MP4...</title>
@@ -285,25 +344,31 @@ def download_mp4():
 
 @app.route("/raw")
 def raw():
-    return send_file(request.args.get("file"), mimetype="application/json")
+    path = request.args.get("file")
+    if sessionarchive.is_archived(path):
+        return Response(archived_cast_lines(path), mimetype="application/json")
+    return send_file(path, mimetype="application/json")
 
 @app.route("/extract")
 def extract():
     path = request.args.get("file")
     start = float(request.args.get("start", "0"))
     end = float(request.args.get("end", "999999"))
-    with open(path) as f:
-        lines = f.readlines()
-    header = lines[0]
+    if sessionarchive.is_archived(path):
+        lines = list(archived_cast_lines(path, start, end))
+    else:
+        with open(path) as f:
+            lines = f.readlines()
+    header = lines[0] if lines else ""
     body = [json.loads(l) for l in lines[1:] if l.strip() and l.startswith("[")]
     filtered = [e for e in body if start <= e[0] <= end]
-    outname = os.path.basename(path).replace(".asciinema.gz", ".cast").replace(".asciinema", ".cast")
-    outpath = os.path.join(tempfile.gettempdir(), outname)
-    with open(outpath, 'w') as w:
-        w.write(header)
+    outname = os.path.basename(path).replace(sessionarchive.ARCHIVE_EXT, "").replace(".asciinema.gz", ".cast").replace(".asciinema", ".cast")
+    # Streamed rather than written to a shared temp path that concurrent extracts would clobber.
+    def generate():
+        yield header
         for line in filtered:
-            w.write(json.dumps(line) + "\n")
-    return send_file(outpath, as_attachment=True, download_name=outname)
+            yield json.dumps(line) + "\n"
+    return Response(generate(), mimetype="application/octet-stream", headers={"Content-Disposition": f'attachment; filename="{outname}"'})
 
 @app.route("/extract_mp4")
 def extract_mp4():
@@ -313,8 +378,7 @@ def extract_mp4():
     cast_path = convert_to_cast(file)
     mp4_path = cast_path.replace(".cast", f"_extract_{start:.1f}_{end:.1f}.mp4")
     progress_path = mp4_path + ".progress"
-    if not (os.path.exists(mp4_path) or os.path.exists(progress_path)):
-        threading.Thread(target=convert_cast_to_mp4_progress_extract, args=(cast_path, mp4_path, progress_path, start, end), daemon=True).start()
+    start_render(convert_cast_to_mp4_progress_extract, cast_path, mp4_path, progress_path, start, end)
     return render_template_string("""
 <html><head>
 <title>Generating MP4 extract...</title>
@@ -364,41 +428,69 @@ def format_time(seconds):
     return f"{minutes:02d}:{secs:02d}"
 
 def convert_to_cast(path):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".cast", mode="w", encoding="utf-8")
-    opener = gzip.open if path.endswith(".gz") else open
-    with opener(path, 'rt', encoding='utf-8', errors='ignore') as f_in:
-        try:
-            header_line = next(f_in)
-        except StopIteration:
-            print(f"[!] Fichier vide : {path}")
-            tmp.close()
-            return tmp.name
-        header = {
-            "version": 2,
-            "width": 100,
-            "height": 30,
-            "timestamp": int(os.path.getmtime(path)),
-            "env": {"TERM": "xterm", "SHELL": "/bin/bash"}
-        }
-        try:
-            maybe_header = json.loads(header_line)
-            if isinstance(maybe_header, dict) and "version" in maybe_header:
-                header.update(maybe_header)
-        except Exception as e:
-            print(f"[!] Erreur parsing header: {e}")
-        tmp.write(json.dumps(header) + "\n")
-        for line in f_in:
-            if line.strip().startswith("["):
-                try:
-                    evt = json.loads(line)
-                    if isinstance(evt, list) and evt[1] == "o":
-                        if evt[2].strip():
-                            tmp.write(json.dumps([evt[0], "o", evt[2]]) + "\n")
-                except Exception as e:
-                    print(f"[!] Ligne ignorée: {e} : {line[:80]}")
+    st = os.stat(path)
+    source = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    version = hashlib.sha1(f"{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()[:8]
+    name = os.path.basename(path).split(".asciinema")[0]
+    prefix = os.path.join(sessionstate.CACHE_DIR, f"{name}_{source}")
+    cast_path = f"{prefix}{version}.cast"
+    if not os.path.exists(cast_path):
+        with sessionstate.file_lock(prefix):
+            if not os.path.exists(cast_path):
+                # Drop casts, MP4s and progress files of older versions (e.g. a session still recording).
+                for old in glob(glob_escape(prefix) + "*"):
+                    if not old.endswith(".lock"):
+                        try:
+                            os.remove(old)
+                        except FileNotFoundError:
+                            pass
+                os.replace(write_cast(path), cast_path)
+    return cast_path
+
+def write_cast(path):
+    sessionstate.ensure_state_dir()
+    tmp = tempfile.NamedTemporaryFile(delete=False, dir=sessionstate.CACHE_DIR, prefix=".", suffix=".tmp", mode="w", encoding="utf-8")
+    with open_log(path) as f_in:
+        tmp.writelines(cast_lines(f_in, path))
     tmp.close()
     return tmp.name
 
+def archived_cast_lines(path, start=None, end=None):
+    with sessionarchive.open_session(path, start, end) as f_in:
+        yield from cast_lines(f_in, path)
+
+def cast_lines(f_in, path):
+    try:
+        header_line = next(f_in)
+    except StopIteration:
+        print(f"[!] Fichier vide : {path}")
+        return
+    header = {
+        "version": 2,
+        "width": 100,
+        "height": 30,
+        "timestamp": int(os.path.getmtime(path)),
+        "env": {"TERM": "xterm", "SHELL": "/bin/bash"}
+    }
+    try:
+        maybe_header = json.loads(header_line)
+        if isinstance(maybe_header, dict) and "version" in maybe_header:
+            header.update(maybe_header)
+        else:
+            f_in = itertools.chain([header_line], f_in)
+    except Exception as e:
+        print(f"[!] Erreur parsing header: {e}")
+    yield json.dumps(header) + "\n"
+    for line in f_in:
+        if line.strip().startswith("["):
+            try:
+                evt = json.loads(line)
+                if isinstance(evt, list) and evt[1] == "o":
+                    if evt[2].strip():
+                        yield json.dumps([evt[0], "o", evt[2]]) + "\n"
+            except Exception as e:
+                print(f"[!] Ligne ignorée: {e} : {line[:80]}")
+
 def convert_cast_to_mp4_progress(cast_path, mp4_path, progress_path):
     try:
         print(f"[DEBUG] Starting MP4 conversion: {cast_path} → {mp4_path}")
@@ -522,6 +614,100 @@ def convert_cast_to_mp4_progress_extract(cast_path, mp4_path, progress_path, sta
         with open(progress_path, "w") as pf:
             pf.write(json.dumps({"progress": 0, "done": False, "text": f"Error: {e}"}))
 
+RENDERERS = {f.__name__: f for f in (convert_cast_to_mp4_progress, convert_cast_to_mp4_progress_extract)}
+
+def render_worker():
+    try:
+        while True:
+            job = sessionstate.claim_job()
+            if job is None:
+                time.sleep(1)
+                continue
+            print(f"[+] Render worker {os.getpid()}: {job['mp4_path']}")
+            RENDERERS[job["func"]](*job["args"])
+            sessionstate.finish_job(job["mp4_path"], failed=render_failed(job["args"][2]))
+    except KeyboardInterrupt:
+        pass
+
+def run_http(bind, workers):
+    from gunicorn.app.base import BaseApplication
+
+    # Set here, not inherited: with the spawn/forkserver start methods this child
+    # re-imports the module and would otherwise render in the request workers.
+    global render_queue
+    render_queue = True
+
+    class ViewerApplication(BaseApplication):
+        def load_config(self):
+            # Gunicorn answers send_file() responses with sendfile(2).
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", 4)
+            self.cfg.set("timeout", 300)
+            self.cfg.set("sendfile", True)
+
+        def load(self):
+            return app
+
+    ViewerApplication().run()
+
+def serve(bind, workers, render_workers):
+    # The gunicorn arbiter runs in its own child so request workers never inherit
+    # the render workers; this process supervises both and respawns render workers.
+    sessionstate.requeue_interrupted_jobs()
+    http = multiprocessing.Process(target=run_http, args=(bind, workers))
+    http.start()
+    renderers = []
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"[+] Exegol Replay serving on http://{bind} ({workers} request workers, {render_workers} render workers)")
+    try:
+        while http.is_alive():
+            for p in [p for p in renderers if p.poll() is not None]:
+                print(f"[!] Render worker {p.pid} exited ({p.returncode}), respawning")
+                sessionstate.requeue_interrupted_jobs(p.pid)
+                renderers.remove(p)
+            while len(renderers) < render_workers:
+                renderers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--render-worker"]))
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in renderers:
+            p.terminate()
+        for p in renderers:
+            p.wait()
+        if http.is_alive():
+            http.terminate()
+        http.join()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exegol Sessions Viewer")
+    parser.add_argument("--archive", action="store_true", help="move finished .asciinema.gz sessions into the deduplicated archive store")
+    parser.add_argument("--keep", action="store_true", help="with --archive, keep the original .gz files")
+    parser.add_argument("--archive-stats", action="store_true", help="report dedup ratio and read throughput of the archive store")
+    parser.add_argument("--serve", action="store_true", help="run with multiple request workers and separate render workers")
+    parser.add_argument("--bind", default="127.0.0.1:5005", help="address for --serve and --loadtest")
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 8), help="request worker processes for --serve")
+    parser.add_argument("--render-workers", type=int, default=2, help="MP4 render worker processes for --serve")
+    parser.add_argument("--loadtest", action="store_true", help="report requests/s and p99 latency of a running instance for listing and /raw")
+    parser.add_argument("--render-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.archive:
+        print(f"[+] Archiving sessions into {sessionarchive.ARCHIVE_ROOT}...")
+        sessionarchive.print_report(sessionarchive.archive_sessions(sorted(glob(WORKSPACES + "/*/logs/*.asciinema.gz")), keep=args.keep))
+        sys.exit(0)
+    if args.archive_stats:
+        sessionarchive.print_report(sessionarchive.store_stats())
+        sys.exit(0)
+    if args.loadtest:
+        import loadtest
+        sys.exit(loadtest.main(f"http://{args.bind}"))
+    if args.render_worker:
+        render_worker()
+        sys.exit(0)
+    if args.serve:
+        serve(args.bind, args.workers, args.render_workers)
+        sys.exit(0)
     print("[+] Exegol Replay running on http://127.0.0.1:5005")
     app.run(debug=False, port=5005)
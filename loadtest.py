@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import re
+import sys
+import math
+import time
+import argparse
+import threading
+import urllib.request
+from urllib.parse import quote, unquote
+from html import unescape
+
+
+def fetch(url):
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=120) as r:
+        while r.read(65536):
+            pass
+    return time.perf_counter() - t0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def hammer(url, requests, concurrency):
+    latencies, errors, lock = [], [], threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            try:
+                latency = fetch(url)
+                with lock:
+                    latencies.append(latency)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - t0
+
+
+def find_raw_url(base):
+    with urllib.request.urlopen(base + "/", timeout=120) as r:
+        listing = r.read().decode("utf-8", errors="ignore")
+    m = re.search(r'href="/view\?file=([^"&]+)"', listing)
+    if not m:
+        return None
+    with urllib.request.urlopen(base + "/view?file=" + quote(unescape(m.group(1)), safe="/"), timeout=120) as r:
+        page = r.read().decode("utf-8", errors="ignore")
+    m = re.search(r'"/raw\?file=([^"]+)"', page)
+    return base + "/raw?file=" + quote(unquote(m.group(1)), safe="/") if m else None
+
+
+def run_load_test(base, requests=500, concurrency=16):
+    base = base.rstrip("/")
+    targets = [("listing", base + "/")]
+    raw_url = find_raw_url(base)
+    if raw_url:
+        targets.append(("raw", raw_url))
+    else:
+        print("[!] No session found, skipping /raw")
+    fetch(targets[-1][1])
+    for name, url in targets:
+        latencies, errors, elapsed = hammer(url, requests, concurrency)
+        if not latencies:
+            print(f"[!] {name}: all {len(errors)} requests failed ({errors[0]})")
+            continue
+        print(f"[+] {name:<8} {len(latencies)} requests, {concurrency} concurrent: "
+              f"{len(latencies) / elapsed:.1f} req/s, "
+              f"p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.1f} ms, "
+              f"{len(errors)} errors")
+
+
+def main(url, requests=500, concurrency=16):
+    try:
+        run_load_test(url, requests, concurrency)
+    except OSError as e:
+        print(f"[!] Cannot reach {url}: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running Exegol Sessions Viewer")
+    parser.add_argument("--url", default="http://127.0.0.1:5005")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    sys.exit(main(args.url, args.requests, args.concurrency))
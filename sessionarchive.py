@@ -0,0 +1,400 @@
+import os
+import io
+import json
+import zlib
+import gzip
+import glob
+import math
+import time
+import bisect
+import hashlib
+from collections import Counter
+from itertools import accumulate
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+ARCHIVE_ROOT = os.path.expanduser("~/.exegol/esv-archive")
+ARCHIVE_EXT = ".esva"
+MANIFEST_MAGIC = b"ESVA1\n"
+
+# FastCDC-style gear hash: cut points depend on the last 64 bytes only, so
+# recurring output (scan results, banners, ls/cat listings) lands in identical
+# chunks across sessions whatever surrounds it.
+MIN_CHUNK = 2 * 1024
+MAX_CHUNK = 64 * 1024
+CUT_BITS = 12
+CUT_MASK = ((1 << CUT_BITS) - 1) << (64 - CUT_BITS)
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+
+DICT_SIZE = {"zlib": 32 * 1024, "zstd": 112 * 1024}
+DICT_SAMPLE_SESSIONS = 64
+
+
+def is_archived(path):
+    return path.endswith(ARCHIVE_EXT)
+
+
+def archive_path(path, root=ARCHIVE_ROOT):
+    container = path.split(os.sep)[-3]
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return os.path.join(root, container, "logs", name + ARCHIVE_EXT)
+
+
+def cdc_chunks(data):
+    n, start = len(data), 0
+    while start < n:
+        end = min(start + MAX_CHUNK, n)
+        cut, h = end, 0
+        for i in range(start + MIN_CHUNK, end):
+            h = ((h << 1) + GEAR[data[i]]) & 0xFFFFFFFFFFFFFFFF
+            if not h & CUT_MASK:
+                cut = i + 1
+                break
+        yield data[start:cut]
+        start = cut
+
+
+def split_line(line):
+    # b'[12.5, "o", "id\r\n"]\n' -> ("[12.5", b', "o", "id\r\n"]\n')
+    # Timestamps are kept out of the chunked stream so repeated output dedups.
+    if line.startswith(b"["):
+        cut = line.find(b",")
+        if cut > 1:
+            try:
+                if math.isfinite(float(line[1:cut])):
+                    return line[:cut].decode("ascii"), line[cut:]
+            except ValueError:
+                pass
+    return None, line
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ArchiveStore:
+    def __init__(self, root=ARCHIVE_ROOT):
+        self.root = root
+        self.config_path = os.path.join(root, "store.json")
+        self.dict_path = os.path.join(root, "dictionary")
+        self.config = None
+        self._compressor = None
+        self._decompressor = None
+        if os.path.exists(self.config_path):
+            with open(self.config_path) as f:
+                self.config = json.load(f)
+
+    @property
+    def ready(self):
+        return self.config is not None
+
+    def create(self, samples):
+        codec = "zstd" if zstandard else "zlib"
+        counts = Counter(hashlib.sha256(s).digest() for s in samples)
+        seen, picked, size = set(), [], 0
+        for s in sorted(samples, key=lambda s: counts[hashlib.sha256(s).digest()] * len(s), reverse=True):
+            key = hashlib.sha256(s).digest()
+            if key in seen:
+                continue
+            seen.add(key)
+            piece = s[:DICT_SIZE[codec] // 8]
+            if size + len(piece) > DICT_SIZE[codec]:
+                break
+            picked.append(piece)
+            size += len(piece)
+        # Deflate favours dictionary content closest to the end: most frequent last.
+        dictionary = b"".join(reversed(picked))
+        if dictionary:
+            _atomic_write(self.dict_path, dictionary)
+        self.config = {
+            "version": 1,
+            "codec": codec,
+            "dictionary": hashlib.sha256(dictionary).hexdigest() if dictionary else None,
+        }
+        _atomic_write(self.config_path, json.dumps(self.config).encode())
+
+    def _dictionary(self):
+        if not self.config["dictionary"]:
+            return None
+        with open(self.dict_path, "rb") as f:
+            return f.read()
+
+    def _codec(self):
+        if self._compressor:
+            return
+        dictionary = self._dictionary()
+        if self.config["codec"] == "zstd":
+            if zstandard is None:
+                raise RuntimeError("archive store uses zstd, install the 'zstandard' package")
+            zdict = zstandard.ZstdCompressionDict(dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT) if dictionary else None
+            cctx = zstandard.ZstdCompressor(level=19, dict_data=zdict)
+            dctx = zstandard.ZstdDecompressor(dict_data=zdict)
+            self._compressor, self._decompressor = cctx.compress, dctx.decompress
+        else:
+            def compress(data):
+                c = zlib.compressobj(9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, **({"zdict": dictionary} if dictionary else {}))
+                return c.compress(data) + c.flush()
+
+            def decompress(data):
+                d = zlib.decompressobj(**({"zdict": dictionary} if dictionary else {}))
+                return d.decompress(data) + d.flush()
+            self._compressor, self._decompressor = compress, decompress
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        self._codec()
+        blob = self._compressor(data)
+        _atomic_write(path, blob)
+        return digest, len(blob)
+
+    def get(self, digest):
+        self._codec()
+        with open(self.object_path(digest), "rb") as f:
+            return self._decompressor(f.read())
+
+
+class ArchivedSession:
+    def __init__(self, path):
+        self.path = path
+        self.store = ArchiveStore(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(path)))))
+        with open(path, "rb") as f:
+            blob = f.read()
+        if not blob.startswith(MANIFEST_MAGIC):
+            raise ValueError(f"not a session archive: {path}")
+        self.manifest = json.loads(zlib.decompress(blob[len(MANIFEST_MAGIC):]))
+        self.chunks = self.manifest["chunks"]
+        self.chunk_offsets = [0] + list(accumulate(n for _, n in self.chunks))
+        self.prefixes = [p for p, _ in self.manifest["lines"]]
+        self.line_offsets = [0] + list(accumulate(n for _, n in self.manifest["lines"]))
+        self.times, t = [], -math.inf
+        for p in self.prefixes:
+            if p is not None:
+                t = float(p[1:])
+            self.times.append(t)
+
+    def _payloads(self, first, last):
+        if first >= last:
+            return
+        pos = self.line_offsets[first]
+        ci = bisect.bisect_right(self.chunk_offsets, pos) - 1
+        buf, base = b"", pos
+        for i in range(first, last):
+            s, e = self.line_offsets[i], self.line_offsets[i + 1]
+            if e > base + len(buf):
+                parts = [buf[s - base:]]
+                base = s
+                have = base + len(parts[0])
+                while have < e:
+                    c0 = self.chunk_offsets[ci]
+                    data = self.store.get(self.chunks[ci][0])
+                    ci += 1
+                    parts.append(data[have - c0:])
+                    have = c0 + len(data)
+                buf = b"".join(parts)
+            yield i, buf[s - base:e - base]
+
+    def iter_lines(self, start=None, end=None):
+        n = len(self.prefixes)
+        if start is None and end is None:
+            ranges = [(0, n, False)]
+        else:
+            # Header lines, then only the timed events inside [start, end].
+            first_timed = next((i for i, p in enumerate(self.prefixes) if p is not None), n)
+            lo = bisect.bisect_left(self.times, -math.inf if start is None else start)
+            hi = bisect.bisect_right(self.times, math.inf if end is None else end)
+            ranges = [(0, first_timed, False), (max(lo, first_timed), hi, True)]
+        for first, last, timed_only in ranges:
+            for i, payload in self._payloads(first, last):
+                prefix = self.prefixes[i]
+                if prefix is None and timed_only:
+                    continue
+                yield (prefix or "").encode("ascii") + payload
+
+    def read(self):
+        return b"".join(self.iter_lines())
+
+
+class _LineStream(io.RawIOBase):
+    def __init__(self, pieces):
+        self._pieces = pieces
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._pieces)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def open_session(path, start=None, end=None):
+    stream = io.BufferedReader(_LineStream(ArchivedSession(path).iter_lines(start, end)))
+    return io.TextIOWrapper(stream, encoding="utf-8", errors="ignore")
+
+
+def _write_manifest(dest, data, source, gz_size, gz_read_s, store):
+    lines, payloads = [], []
+    for line in io.BytesIO(data):
+        prefix, payload = split_line(line)
+        lines.append([prefix, len(payload)])
+        payloads.append(payload)
+    chunks, stored, unique = [], 0, 0
+    for chunk in cdc_chunks(b"".join(payloads)):
+        digest, written = store.put(chunk)
+        chunks.append([digest, len(chunk)])
+        stored += written
+        if written:
+            unique += len(chunk)
+    manifest = {
+        "version": 1,
+        "source": os.path.basename(source),
+        "source_path": os.path.abspath(source),
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "gz_size": gz_size,
+        "gz_read_s": gz_read_s,
+        "chunks": chunks,
+        "lines": lines,
+    }
+    blob = MANIFEST_MAGIC + zlib.compress(json.dumps(manifest, separators=(",", ":")).encode(), 9)
+    _atomic_write(dest, blob)
+    st = os.stat(source)
+    os.utime(dest, (st.st_atime, st.st_mtime))
+    return sum(n for _, n in chunks), unique, stored + len(blob)
+
+
+def _read_gz(path):
+    t0 = time.perf_counter()
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    return data, time.perf_counter() - t0
+
+
+def archive_sessions(paths, root=ARCHIVE_ROOT, keep=False):
+    store = ArchiveStore(root)
+    todo = [p for p in paths if p.endswith(".gz") and not os.path.exists(archive_path(p, root))]
+    stats = Counter()
+    if not todo:
+        return stats
+    # Reads after the sampling pass hit a warm page cache: keep the first timing.
+    first_read_s = {}
+    if not store.ready:
+        samples = []
+        for path in todo[:DICT_SAMPLE_SESSIONS]:
+            data, first_read_s[path] = _read_gz(path)
+            samples.extend(cdc_chunks(b"".join(split_line(l)[1] for l in io.BytesIO(data))))
+        store.create(samples)
+        if os.path.exists(store.dict_path):
+            stats["stored_bytes"] += os.path.getsize(store.dict_path)
+    for path in todo:
+        dest = archive_path(path, root)
+        try:
+            gz_size = os.path.getsize(path)
+            data, gz_read_s = _read_gz(path)
+            gz_read_s = first_read_s.get(path, gz_read_s)
+            referenced, unique, stored = _write_manifest(dest, data, path, gz_size, gz_read_s, store)
+            t0 = time.perf_counter()
+            restored = ArchivedSession(dest).read()
+            read_s = time.perf_counter() - t0
+        except Exception as e:
+            print(f"[!] Error archiving {path}: {e}")
+            if os.path.exists(dest):
+                os.remove(dest)
+            continue
+        if restored != data:
+            print(f"[!] Verification failed, keeping original: {path}")
+            os.remove(dest)
+            continue
+        if not keep:
+            os.remove(path)
+        stats["sessions"] += 1
+        stats["raw_bytes"] += len(data)
+        stats["gz_bytes"] += gz_size
+        stats["referenced_bytes"] += referenced
+        stats["unique_bytes"] += unique
+        stats["stored_bytes"] += stored
+        stats["gz_read_s"] += gz_read_s
+        stats["archive_read_s"] += read_s
+    return stats
+
+
+def store_stats(root=ARCHIVE_ROOT):
+    stats, seen = Counter(), set()
+    for path in glob.glob(os.path.join(root, "*", "logs", "*" + ARCHIVE_EXT)):
+        try:
+            session = ArchivedSession(path)
+            t0 = time.perf_counter()
+            data = session.read()
+            read_s = time.perf_counter() - t0
+        except Exception as e:
+            print(f"[!] Error reading {path}: {e}")
+            continue
+        stats["sessions"] += 1
+        stats["raw_bytes"] += len(data)
+        stats["gz_bytes"] += session.manifest["gz_size"]
+        source = session.manifest.get("source_path")
+        if source and os.path.exists(source):
+            # Sessions archived with --keep: time the .gz in this run too.
+            stats["gz_read_s"] += _read_gz(source)[1]
+        else:
+            stats["gz_read_s"] += session.manifest["gz_read_s"]
+            stats["gz_historical"] += 1
+        stats["archive_read_s"] += read_s
+        stats["stored_bytes"] += os.path.getsize(path)
+        for digest, n in session.chunks:
+            stats["referenced_bytes"] += n
+            if digest not in seen:
+                seen.add(digest)
+                stats["unique_bytes"] += n
+                stats["stored_bytes"] += os.path.getsize(session.store.object_path(digest))
+    if stats["sessions"] and os.path.exists(os.path.join(root, "dictionary")):
+        stats["stored_bytes"] += os.path.getsize(os.path.join(root, "dictionary"))
+    return stats
+
+
+def _size(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def print_report(stats):
+    if not stats["sessions"]:
+        print("[*] No sessions to report")
+        return
+    print(f"[+] {stats['sessions']} sessions: {_size(stats['raw_bytes'])} raw, {_size(stats['gz_bytes'])} as .gz")
+    dedup = stats["referenced_bytes"] / stats["unique_bytes"] if stats["unique_bytes"] else float("inf")
+    vs_gz = stats["gz_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else float("inf")
+    print(f"[+] Archive: {_size(stats['stored_bytes'])} stored, dedup ratio {dedup:.2f}x, size ratio vs .gz {vs_gz:.2f}x")
+    mb = 1024 * 1024
+    gz_rate = stats["raw_bytes"] / stats["gz_read_s"] / mb if stats["gz_read_s"] else float("inf")
+    archive_rate = stats["raw_bytes"] / stats["archive_read_s"] / mb if stats["archive_read_s"] else float("inf")
+    # Same bytes on both sides: the speed ratio is the ratio of read times.
+    speedup = stats["gz_read_s"] / stats["archive_read_s"] if stats["archive_read_s"] else float("inf")
+    print(f"[+] Read throughput: .gz {gz_rate:.1f} MB/s, archive {archive_rate:.1f} MB/s ({speedup:.2f}x)")
+    if stats["gz_historical"]:
+        print(f"[*] .gz timing for {stats['gz_historical']} of {stats['sessions']} sessions was recorded at archive time, their .gz is gone")
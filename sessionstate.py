@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import fcntl
+import stat
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+STATE_DIR = os.path.expanduser("~/.exegol/esv-state")
+CACHE_DIR = os.path.join(STATE_DIR, "cache")
+DB_PATH = os.path.join(STATE_DIR, "state.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    mp4_path TEXT PRIMARY KEY,
+    func TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker INTEGER,
+    created REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+_checked = False
+
+
+def ensure_state_dir():
+    # Job rows name the files render workers write, so only this user may touch them.
+    global _checked
+    if _checked:
+        return
+    for path in (STATE_DIR, CACHE_DIR):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+            raise RuntimeError(f"refusing to use {path}: not a directory owned by the current user")
+        if st.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    _checked = True
+
+
+def connect():
+    # One connection per thread and per process: connections must not cross a fork.
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    ensure_state_dir()
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+@contextmanager
+def transaction():
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def file_lock(path):
+    ensure_state_dir()
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def session_timestamps(paths, read_timestamp):
+    known = {row[0]: row[1:] for row in connect().execute("SELECT path, mtime_ns, size, ts FROM sessions")}
+    result, fresh = {}, []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        cached = known.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            result[path] = cached[2]
+            continue
+        result[path] = read_timestamp(path)
+        fresh.append((path, st.st_mtime_ns, st.st_size, result[path]))
+    # Drop sessions that were archived, deleted or moved since the last listing.
+    stale = [(path,) for path in known if path not in result]
+    if fresh or stale:
+        with transaction() as conn:
+            conn.executemany("DELETE FROM sessions WHERE path = ?", stale)
+            conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", fresh)
+    return result
+
+
+def enqueue_job(mp4_path, func, args, on_queued=None):
+    # Returns False when the job is already queued or running. on_queued runs before
+    # the commit, so no render worker can claim the job ahead of it.
+    with transaction() as conn:
+        # A failed job, or a finished one whose output has since been removed, is queued again.
+        cur = conn.execute(
+            "INSERT INTO jobs (mp4_path, func, args, created) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (mp4_path) DO UPDATE SET state = 'queued', created = excluded.created WHERE jobs.state IN ('done', 'failed')",
+            (mp4_path, func, json.dumps(args), time.time()),
+        )
+        if not cur.rowcount:
+            return False
+        if on_queued:
+            on_queued()
+    return True
+
+
+def claim_job():
+    with transaction() as conn:
+        row = conn.execute("SELECT mp4_path, func, args FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1").fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET state = 'running', worker = ? WHERE mp4_path = ?", (os.getpid(), row[0]))
+    return {"mp4_path": row[0], "func": row[1], "args": json.loads(row[2])}
+
+
+def finish_job(mp4_path, failed=False):
+    with transaction() as conn:
+        conn.execute("UPDATE jobs SET state = ? WHERE mp4_path = ?", ("failed" if failed else "done", mp4_path))
+
+
+def requeue_interrupted_jobs(worker=None):
+    with transaction() as conn:
+        if worker is None:
+            conn.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+        else:
+            conn.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running' AND worker = ?", (worker,))